@@ -1,27 +1,118 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, ORJSONResponse
+from fastapi.concurrency import run_in_threadpool
 import pandas as pd
 import numpy as np
+import msgspec
+import orjson
+import pyarrow as pa
+from pyarrow import csv as pa_csv
 import joblib
 import os
+import asyncio
+import csv
+import queue
+import random
+import tempfile
+import time
 import logging
-from typing import List, Optional
-import io
+from logging.handlers import QueueHandler, QueueListener
+from contextlib import asynccontextmanager
+from typing import Iterator, List, Optional, Tuple
 from fastapi.openapi.docs import get_redoc_html
-from .model import HeartAttackModel
-from .schemas import PredictionResponse, BatchPredictionResponse
+from .model import DROP_COLS, HeartAttackModel
+from .schemas import PredictionResponse, BatchPredictionResponse, make_patient_struct
+from .utils import PredictionStatistics
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Доля успешных запросов, попадающих в лог (ошибки логируются всегда)
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+
+# Файлы с предсказаниями: отдельный файл на запрос, по возможности в tmpfs
+PREDICTIONS_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+PREDICTIONS_PREFIX = "heart_predictions_"
+# Время хранения файлов с предсказаниями, секунд
+PREDICTIONS_TTL = 3600
+
+def cleanup_predictions(max_age: float = PREDICTIONS_TTL) -> int:
+    """
+    Удаление устаревших файлов с предсказаниями
+    
+    Args:
+        max_age: Максимальный возраст файла, секунд
+    
+    Returns:
+        Количество удаленных файлов
+    """
+    now = time.time()
+    removed = 0
+    for entry in os.scandir(PREDICTIONS_DIR):
+        if not (entry.name.startswith(PREDICTIONS_PREFIX) and entry.name.endswith('.csv')):
+            continue
+        try:
+            if now - entry.stat().st_mtime > max_age:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            # Файл уже удален другим воркером
+            pass
+    return removed
+
+async def cleanup_predictions_periodically():
+    """Фоновая задача очистки файлов с предсказаниями"""
+    while True:
+        await asyncio.sleep(PREDICTIONS_TTL / 4)
+        try:
+            removed = await run_in_threadpool(cleanup_predictions)
+            if removed:
+                logger.info(f"Удалено устаревших файлов с предсказаниями: {removed}")
+        except Exception as e:
+            logger.error(f"Ошибка очистки файлов с предсказаниями: {e}")
+
+def start_log_listener() -> QueueListener:
+    """
+    Перевод корневого логгера на очередь с фоновым потоком вывода
+    
+    Сообщение форматируется в вызывающем потоке (QueueHandler.prepare), а запись
+    в обработчики (stderr, файлы) выполняет поток QueueListener. Поток не переживает
+    fork(), поэтому запускается в каждом процессе отдельно — из lifespan.
+    
+    Returns:
+        Запущенный QueueListener
+    """
+    root_logger = logging.getLogger()
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *root_logger.handlers, respect_handler_level=True)
+    root_logger.handlers = [QueueHandler(log_queue)]
+    listener.start()
+    return listener
+
+def stop_log_listener(listener: QueueListener):
+    """Остановка QueueListener и возврат исходных обработчиков корневого логгера"""
+    listener.stop()
+    logging.getLogger().handlers = list(listener.handlers)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_listener = start_log_listener()
+    cleanup_task = asyncio.create_task(cleanup_predictions_periodically())
+    try:
+        yield
+    finally:
+        cleanup_task.cancel()
+        stop_log_listener(log_listener)
+
 # Инициализация приложения
 app = FastAPI(
     title="Heart Attack Prediction API",
     description="API для предсказания риска сердечного приступа",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 @app.get("/redoc", include_in_schema=False)
@@ -32,10 +123,18 @@ async def redoc_html():
         redoc_js_url="https://cdn.jsdelivr.net/npm/redoc@next/bundles/redoc.standalone.js"
     )
 
-# Загрузка модели
-MODEL_PATH = os.path.join(os.path.dirname(__file__), "..", "models", "best_model.pkl")
+# Размер блока, которым Arrow разбирает CSV (8 МБ); один блок — одна порция предсказаний
+CSV_BLOCK_SIZE = 8 << 20
+
+# Загрузка модели при импорте модуля: при запуске через gunicorn --preload
+# модель загружается один раз в родительском процессе и наследуется воркерами
+MODEL_PATH = os.getenv(
+    "MODEL_PATH", os.path.join(os.path.dirname(__file__), "..", "models", "best_model.pkl")
+)
+# Режим отображения массивов модели в память для joblib ('r' и т.п.; по умолчанию выключен)
+MODEL_MMAP_MODE = os.getenv("MODEL_MMAP_MODE") or None
 try:
-    model = HeartAttackModel(MODEL_PATH)
+    model = HeartAttackModel(MODEL_PATH, mmap_mode=MODEL_MMAP_MODE)
     logger.info(f"Модель успешно загружена из {MODEL_PATH}")
 except Exception as e:
     logger.error(f"Ошибка загрузки модели: {e}")
@@ -50,6 +149,7 @@ async def root():
         "endpoints": {
             "/docs": "Документация Swagger",
             "/predict/csv": "Загрузка CSV файла для предсказаний",
+            "/predict/csv/stream": "Загрузка CSV файла с потоковой выдачей предсказаний в CSV",
             "/health": "Проверка работоспособности API",
             "/model/info": "Информация о модели"
         }
@@ -76,55 +176,240 @@ async def model_info():
     
     return model.get_model_info()
 
-@app.post("/predict/csv", response_model=BatchPredictionResponse)
-async def predict_from_csv(file: UploadFile = File(...)):
+def read_csv_header(contents: bytes) -> List[str]:
     """
-    Получение предсказаний из CSV файла
+    Названия столбцов из первой строки CSV файла
     
-    - **file**: CSV файл с данными для предсказания
-    - **returns**: JSON с предсказаниями и возможностью скачать CSV
+    Args:
+        contents: Содержимое CSV файла
+    
+    Returns:
+        Список названий столбцов в исходном регистре
+    """
+    end = contents.find(b'\n')
+    first_line = contents[:end if end >= 0 else len(contents)].decode('utf-8-sig', errors='replace')
+    return next(csv.reader([first_line.rstrip('\r')]), [])
+
+def open_csv_reader(contents: bytes) -> pa_csv.CSVStreamingReader:
+    """
+    Потоковое чтение CSV файла
+    
+    Многопоточный парсер Arrow читает байты напрямую и отдает файл блоками,
+    поэтому пиковая память ограничена размером блока.
+    
+    Args:
+        contents: Содержимое CSV файла
+    
+    Returns:
+        Итератор по блокам (RecordBatch) файла
+    
+    Raises:
+        ValueError: если в файле нет признаков модели
+    """
+    header = read_csv_header(contents)
+    columns = {name.lower() for name in header}
+    missing = [col for col in model.feature_order if col not in columns]
+    if missing:
+        raise ValueError(f"Отсутствуют столбцы: {', '.join(missing)}")
+    
+    # Читаются только признаки модели и id: остальные столбцы (income и любые лишние)
+    # не разбираются вовсе, поэтому их тип не выводится по первому блоку
+    include_columns = []
+    if model.feature_order:
+        needed = set(model.feature_order) | {'id'}
+        include_columns = [name for name in header if name.lower() in needed]
+    
+    # Типы прочитанных столбцов фиксируются заранее: иначе Arrow выводит их
+    # по первому блоку, и, например, 'Male' в gender дальше по файлу дает ошибку.
+    # Числовые признаки сразу читаются как float32
+    column_types = {}
+    for name in header:
+        dtype = model.read_dtypes.get(name.lower())
+        if dtype is not None:
+            column_types[name] = pa.string() if dtype is str else pa.from_numpy_dtype(dtype)
+    
+    return pa_csv.open_csv(
+        pa.BufferReader(contents),
+        read_options=pa_csv.ReadOptions(use_threads=True, block_size=CSV_BLOCK_SIZE),
+        convert_options=pa_csv.ConvertOptions(column_types=column_types, include_columns=include_columns)
+    )
+
+def iter_predictions(reader: pa_csv.CSVStreamingReader) -> Iterator[pd.DataFrame]:
+    """
+    Предсказания по блокам CSV файла
+    
+    Args:
+        reader: Потоковый читатель CSV
+    
+    Yields:
+        DataFrame с ID и предсказаниями для очередного блока
     """
+    start_index = 0
+    for batch in reader:
+        chunk_predictions = model.predict_batch(batch.to_pandas(), start_index=start_index)
+        start_index += len(chunk_predictions)
+        yield chunk_predictions
+
+def restore_integer_ids(ids: pd.Series) -> pd.Series:
+    """
+    Целые id из текстового столбца id
+    
+    id читается из CSV как текст, чтобы его тип не зависел от первого блока.
+    Если все id — целые числа, в ответе они возвращаются числами, как раньше.
+    
+    Args:
+        ids: Столбец id
+    
+    Returns:
+        Столбец int64 или исходный столбец, если хотя бы один id не целое число
+    """
+    if ids.dtype != object or ids.empty:
+        return ids
+    numeric = pd.to_numeric(ids, errors='coerce')
+    if not pd.api.types.is_integer_dtype(numeric):
+        return ids
+    return numeric
+
+def predict_csv_to_file(reader: pa_csv.CSVStreamingReader) -> Tuple[pd.DataFrame, PredictionStatistics, str]:
+    """
+    Потоковое предсказание с сохранением результата в отдельный файл
+    
+    Args:
+        reader: Потоковый читатель CSV
+    
+    Returns:
+        DataFrame с ID и предсказаниями, статистика и имя файла в PREDICTIONS_DIR
+    """
+    statistics = PredictionStatistics()
+    chunks = []
+    
+    with tempfile.NamedTemporaryFile(
+        'w', newline='', delete=False, dir=PREDICTIONS_DIR, prefix=PREDICTIONS_PREFIX, suffix='.csv'
+    ) as fh:
+        try:
+            fh.write("id,prediction\n")
+            for chunk_predictions in iter_predictions(reader):
+                chunk_predictions.to_csv(fh, header=False, index=False)
+                statistics.update(chunk_predictions['prediction'].to_numpy())
+                chunks.append(chunk_predictions)
+        except Exception:
+            os.remove(fh.name)
+            raise
+    
+    predictions_df = (
+        pd.concat(chunks, ignore_index=True) if chunks
+        else pd.DataFrame(columns=['id', 'prediction'])
+    )
+    predictions_df['id'] = restore_integer_ids(predictions_df['id'])
+    return predictions_df, statistics, os.path.basename(fh.name)
+
+def iter_csv_predictions(
+    first_chunk: Optional[pd.DataFrame], predictions: Iterator[pd.DataFrame]
+) -> Iterator[bytes]:
+    """
+    Предсказания в формате CSV, по блоку за раз
+    
+    Args:
+        first_chunk: Уже посчитанные предсказания первого блока (None — файл без строк)
+        predictions: Итератор предсказаний по остальным блокам
+    
+    Yields:
+        Байты CSV: сначала заголовок, затем строки очередного блока
+    """
+    yield b"id,prediction\n"
+    if first_chunk is None:
+        return
+    yield first_chunk.to_csv(header=False, index=False).encode('utf-8')
+    
+    try:
+        for chunk_predictions in predictions:
+            yield chunk_predictions.to_csv(header=False, index=False).encode('utf-8')
+    except Exception as e:
+        # Статус ответа уже отправлен: остается оборвать поток и записать ошибку в лог
+        logger.error(f"Ошибка обработки файла при потоковой выдаче: {str(e)}")
+        raise
+
+def check_csv_upload(file: UploadFile):
+    """Проверка готовности модели и формата загруженного файла"""
     if not model:
         raise HTTPException(status_code=503, detail="Модель не загружена")
     
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="Файл должен быть в формате CSV")
+
+# Схема ответа указана только для документации: построчная валидация
+# pydantic на больших пакетах стоит дороже самого предсказания
+@app.post(
+    "/predict/csv",
+    response_class=ORJSONResponse,
+    responses={200: {"model": BatchPredictionResponse}}
+)
+async def predict_from_csv(file: UploadFile = File(...)):
+    """
+    Получение предсказаний из CSV файла
+    
+    - **file**: CSV файл с данными для предсказания
+    - **returns**: JSON с предсказаниями и возможностью скачать CSV
+    """
+    check_csv_upload(file)
     
     try:
-        # Чтение CSV файла
         contents = await file.read()
-        df = pd.read_csv(io.StringIO(contents.decode('utf-8')))
-        
-        logger.info(f"Загружен файл: {file.filename}, строк: {len(df)}")
         
-        # Получение предсказаний
-        predictions_df = model.predict_batch(df)
+        # Разбор и предсказание выполняются в пуле потоков, чтобы не блокировать event loop
+        reader = await run_in_threadpool(open_csv_reader, contents)
+        predictions_df, statistics, output_name = await run_in_threadpool(predict_csv_to_file, reader)
         
-        # Конвертация в JSON
-        predictions_json = predictions_df.to_dict(orient='records')
+        logger.info(f"Загружен файл: {file.filename}, строк: {statistics.count}")
         
-        # Сохранение временного файла с предсказаниями
-        output_path = "temp_predictions.csv"
-        predictions_df.to_csv(output_path, index=False)
-        
-        return BatchPredictionResponse(
-            message=f"Обработано {len(predictions_df)} записей",
-            predictions=predictions_json,
-            download_url=f"/download/{output_path}",
-            statistics={
-                "mean": float(predictions_df['prediction'].mean()),
-                "min": float(predictions_df['prediction'].min()),
-                "max": float(predictions_df['prediction'].max()),
-                "std": float(predictions_df['prediction'].std()),
-                "risk_count": int((predictions_df['prediction'] > 0.5).sum()),
-                "no_risk_count": int((predictions_df['prediction'] <= 0.5).sum())
-            }
+        # Сериализация в JSON: orjson пишет float32 в кратчайшей записи (0.1, а не
+        # 0.100000001490116), как и CSV для скачивания, и без потери малых вероятностей
+        predictions_json = orjson.dumps(
+            [{"id": patient_id, "prediction": prediction}
+             for patient_id, prediction in zip(predictions_df['id'].tolist(), predictions_df['prediction'].to_numpy())],
+            option=orjson.OPT_SERIALIZE_NUMPY
         )
         
+        return ORJSONResponse({
+            "message": f"Обработано {statistics.count} записей",
+            "predictions": orjson.Fragment(predictions_json),
+            "download_url": f"/download/{output_name}",
+            "statistics": statistics.to_dict()
+        })
+        
     except Exception as e:
         logger.error(f"Ошибка обработки файла: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Ошибка обработки файла: {str(e)}")
 
+@app.post("/predict/csv/stream")
+async def predict_from_csv_stream(file: UploadFile = File(...)):
+    """
+    Получение предсказаний из CSV файла в виде CSV
+    
+    Предсказания отдаются по мере обработки блоков файла, без сохранения на диск.
+    
+    - **file**: CSV файл с данными для предсказания
+    - **returns**: CSV файл со столбцами id и prediction
+    """
+    check_csv_upload(file)
+    
+    try:
+        contents = await file.read()
+        # Заголовок проверяется и первый блок предсказывается до начала ответа,
+        # чтобы ошибки формата и данных вернулись статусом, а не пустым телом
+        reader = await run_in_threadpool(open_csv_reader, contents)
+        predictions = iter_predictions(reader)
+        first_chunk = await run_in_threadpool(next, predictions, None)
+    except Exception as e:
+        logger.error(f"Ошибка обработки файла: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Ошибка обработки файла: {str(e)}")
+    
+    return StreamingResponse(
+        iter_csv_predictions(first_chunk, predictions),
+        media_type='text/csv',
+        headers={"Content-Disposition": 'attachment; filename="heart_attack_predictions.csv"'}
+    )
+
 @app.get("/download/{filename}")
 async def download_file(filename: str):
     """
@@ -132,37 +417,96 @@ async def download_file(filename: str):
     
     - **filename**: имя файла для скачивания
     """
-    if filename != "temp_predictions.csv":
+    if (os.path.basename(filename) != filename
+            or not filename.startswith(PREDICTIONS_PREFIX)
+            or not filename.endswith('.csv')):
         raise HTTPException(status_code=404, detail="Файл не найден")
     
-    if not os.path.exists(filename):
+    path = os.path.join(PREDICTIONS_DIR, filename)
+    if not os.path.exists(path):
         raise HTTPException(status_code=404, detail="Файл не найден")
     
     return FileResponse(
-        filename, 
+        path, 
         media_type='text/csv',
         filename="heart_attack_predictions.csv"
     )
 
-@app.post("/predict/single", response_model=PredictionResponse)
-async def predict_single(data: dict):
+# Тело запроса разбирается msgspec, а не FastAPI: без промежуточной валидации pydantic.
+# Схема строится по признакам загруженной модели
+PatientIn = make_patient_struct(model.feature_order, ignored=DROP_COLS) if model and model.feature_order else None
+patient_decoder = msgspec.json.Decoder(PatientIn) if PatientIn is not None else None
+patient_openapi = {}
+if PatientIn is not None:
+    patient_openapi = {
+        "requestBody": {
+            "content": {
+                "application/json": {"schema": msgspec.json.schema_components([PatientIn])[1]["PatientIn"]}
+            },
+            "required": True
+        }
+    }
+
+def decode_patient(body: bytes):
+    """
+    Разбор тела /predict/single в PatientIn
+    
+    Байты декодируются сразу в типизированную структуру. Только если данные
+    не прошли проверку схемы (например, названия признаков в другом регистре),
+    JSON разбирается в словарь, названия приводятся к нижнему регистру
+    и словарь проверяется повторно.
+    
+    Args:
+        body: Тело запроса
+    
+    Returns:
+        Экземпляр PatientIn
+    
+    Raises:
+        msgspec.MsgspecError: некорректный JSON или данные не соответствуют схеме
+    """
+    try:
+        return patient_decoder.decode(body)
+    except msgspec.ValidationError:
+        data = msgspec.json.decode(body)
+        if not isinstance(data, dict):
+            raise
+        # Названия признаков, как и в CSV, не зависят от регистра
+        return msgspec.convert({str(key).lower(): value for key, value in data.items()}, PatientIn)
+
+@app.post("/predict/single", response_model=PredictionResponse, openapi_extra=patient_openapi)
+async def predict_single(request: Request):
     """
     Получение предсказания для одного пациента
     
-    - **data**: JSON с данными пациента
+    - **data**: JSON с данными пациента (все признаки модели; null — пропуск)
     """
     if not model:
         raise HTTPException(status_code=503, detail="Модель не загружена")
     
     try:
-        # Конвертация в DataFrame
-        df = pd.DataFrame([data])
-        
+        body = await request.body()
+        if PatientIn is not None:
+            patient = decode_patient(body)
+            # Первые поля PatientIn — признаки модели в порядке обучения
+            features = msgspec.structs.astuple(patient)[:len(model.feature_order)]
+            predict = model.predict_single_values
+            patient_id = patient.id
+        else:
+            data = msgspec.json.decode(body)
+            if not isinstance(data, dict):
+                raise msgspec.ValidationError("Expected `object`")
+            predict, features = model.predict_single_fast, data
+            patient_id = data.get('id')
+    except msgspec.MsgspecError as e:
+        raise HTTPException(status_code=422, detail=f"Некорректные данные пациента: {str(e)}")
+    
+    try:
         # Получение предсказания
-        prediction = model.predict_single(df)
+        prediction = await run_in_threadpool(predict, features)
         
         return PredictionResponse(
-            patient_id=data.get('id', 'unknown'),
+            patient_id=str(patient_id) if patient_id is not None else 'unknown',
             prediction=float(prediction),
             risk_level="Высокий" if prediction > 0.5 else "Низкий",
             confidence=float(abs(prediction - 0.5) * 2)  # Уверенность в предсказании
@@ -174,7 +518,7 @@ async def predict_single(data: dict):
 # Middleware для логирования
 @app.middleware("http")
 async def log_requests(request, call_next):
-    logger.info(f"Запрос: {request.method} {request.url}")
     response = await call_next(request)
-    logger.info(f"Ответ: {response.status_code}")
+    if response.status_code >= 400 or random.random() < LOG_SAMPLE_RATE:
+        logger.info("Запрос: %s %s, ответ: %s", request.method, request.url, response.status_code)
     return response
\ No newline at end of file
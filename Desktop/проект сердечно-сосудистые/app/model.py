@@ -1,23 +1,115 @@
 import joblib
+import pickle
 import pandas as pd
 import numpy as np
 import os
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Sequence, Tuple
 import logging
 
+try:
+    from numba import njit
+except ImportError:  # numba — необязательная зависимость
+    njit = None
+
 logger = logging.getLogger(__name__)
 
+# Число потоков для пакетного предсказания (одно ядро остается event loop)
+PREDICT_N_JOBS = max(1, (os.cpu_count() or 1) - 1)
+
+# Расширение файлов модели, сохраненных обычным pickle
+PICKLE_EXTENSION = '.pickle'
+
+# Технические столбцы, не участвующие в предсказании
+DROP_COLS = ('unnamed:_0', 'id', 'income')
+
+# Бинарные признаки
+BINARY_COLS = ('diabetes', 'family_history', 'smoking', 'obesity',
+               'alcohol_consumption', 'previous_heart_problems', 'medication_use')
+
+# Столбцы, которые читаются из CSV как строки: gender содержит и числа, и 'Male'/'Female',
+# а id может быть любым текстом. Тип id не выводится по первому блоку: целые id в начале
+# файла и текстовый id дальше по файлу иначе дают ошибку. Поэтому id в ответе — строка
+STRING_COLS = ('gender', 'id')
+
+# Кодирование gender, как при обучении модели в ноутбуке: значение приводится к строке
+# и ищется в словаре, поэтому числа кодируются так же, как их строковая запись
+# (1 и '1.0' -> 0), а пропуски и неизвестные значения дают 0
+GENDER_MAP = {'male': 0, 'female': 1, '1.0': 0, '0.0': 1, '1': 0, '0': 1}
+
+# Отсортированные ключи GENDER_MAP и их значения для поиска через np.searchsorted
+GENDER_KEYS = np.array(sorted(GENDER_MAP))
+GENDER_VALUES = np.array([GENDER_MAP[key] for key in GENDER_KEYS], dtype=np.int8)
+
+if njit is not None:
+    # Без parallel=True: на 7 столбцах он ничего не дает, а пул потоков numba,
+    # впервые запущенный из потока-обработчика запроса, мешает завершению процесса
+    @njit(cache=True)
+    def _fill_binary_kernel(x: np.ndarray, fills: np.ndarray) -> np.ndarray:
+        out = np.empty(x.shape, dtype=np.int8)
+        for j in range(x.shape[1]):
+            fill = fills[j]
+            for i in range(x.shape[0]):
+                value = x[i, j]
+                out[i, j] = np.int8(np.rint(fill if value != value else value))
+        return out
+
+def encode_gender(values: np.ndarray) -> np.ndarray:
+    """
+    Кодирование gender по GENDER_MAP; неизвестные значения и пропуски дают 0
+    
+    Args:
+        values: Массив значений gender (строки, числа или смешанные типы)
+    
+    Returns:
+        Массив int8 с кодами
+    """
+    # U8 вмещает любой ключ GENDER_MAP; более длинные строки все равно не совпадут
+    arr = np.char.lower(values.astype('U8'))
+    idx = np.searchsorted(GENDER_KEYS, arr).clip(max=len(GENDER_KEYS) - 1)
+    return np.where(GENDER_KEYS[idx] == arr, GENDER_VALUES[idx], 0).astype(np.int8)
+
+def fill_binary(x: np.ndarray, fills: np.ndarray) -> np.ndarray:
+    """
+    Заполнение пропусков, округление и приведение бинарных признаков к int8
+    
+    С numba выполняется одним проходом по массиву, без нее — средствами numpy.
+    
+    Args:
+        x: Массив значений (строки × столбцы), float32
+        fills: Значения для пропусков по столбцам
+    
+    Returns:
+        Массив int8 той же формы
+    """
+    if njit is not None:
+        return _fill_binary_kernel(np.asfortranarray(x), fills.astype(np.float32))
+    return np.rint(np.where(np.isnan(x), fills, x)).astype(np.int8)
+
 class HeartAttackModel:
-    def __init__(self, model_path: str):
+    def __init__(self, model_path: str, mmap_mode: Optional[str] = None):
         """
         Инициализация модели
         
         Args:
-            model_path: Путь к сохраненной модели .pkl
+            model_path: Путь к сохраненной модели: .pkl (joblib) или .pickle (pickle, протокол 5)
+            mmap_mode: Режим отображения массивов модели в память для joblib
+                (по умолчанию массивы загружаются в память процесса). Деревья sklearn
+                копируют свои массивы при распаковке, поэтому отображаются только
+                массивы вроде коэффициентов и параметров scaler; процесс при этом
+                зависит от файла модели на диске
         """
         self.model_path = model_path
+        self.mmap_mode = mmap_mode
         self.model = None
         self.feature_names = None
+        # Типы столбцов для чтения CSV: числовые признаки — float32, gender и id — строки
+        self.read_dtypes: Dict[str, Any] = {}
+        # Порядок признаков, на которых обучалась модель
+        self._feature_order: Tuple[str, ...] = ()
+        # Медианы признаков из обучающей выборки
+        self._fill_values: Dict[str, float] = {}
+        # Разобранная схема последнего набора столбцов: (ключ, схема)
+        self._schema_cache: Optional[Tuple[tuple, Dict[str, Any]]] = None
         self.load_model()
     
     def load_model(self):
@@ -26,7 +118,11 @@ class HeartAttackModel:
             if not os.path.exists(self.model_path):
                 raise FileNotFoundError(f"Файл модели не найден: {self.model_path}")
             
-            self.model = joblib.load(self.model_path)
+            if self.model_path.endswith(PICKLE_EXTENSION):
+                with open(self.model_path, 'rb') as f:
+                    self.model = pickle.load(f)
+            else:
+                self.model = joblib.load(self.model_path, mmap_mode=self.mmap_mode)
             
             # Получение имен признаков
             if hasattr(self.model, 'feature_names_in_'):
@@ -37,12 +133,126 @@ class HeartAttackModel:
             else:
                 self.feature_names = []
             
+            self._configure_parallelism()
+            # Компиляция ядра numba при загрузке, а не на первом запросе
+            fill_binary(np.zeros((1, len(BINARY_COLS)), dtype=np.float32),
+                        np.zeros(len(BINARY_COLS), dtype=np.float32))
+            self._fill_values = self._get_training_medians()
+            self._feature_order = tuple(
+                str(name).lower() for name in getattr(self.model, 'feature_names_in_', ())
+            )
+            self.read_dtypes = {
+                col: np.float32 for col in self._feature_order if col not in STRING_COLS
+            }
+            self.read_dtypes.update({col: str for col in STRING_COLS})
+            self._schema_cache = None
+            
             logger.info(f"Модель загружена успешно. Признаков: {len(self.feature_names) if self.feature_names else 'неизвестно'}")
             
         except Exception as e:
             logger.error(f"Ошибка загрузки модели: {e}")
             raise
     
+    @property
+    def feature_order(self) -> Tuple[str, ...]:
+        """Признаки модели (в нижнем регистре) в порядке обучения"""
+        return self._feature_order
+    
+    def _configure_parallelism(self):
+        """
+        Сброс n_jobs, сохраненного в шагах модели при обучении
+        
+        При n_jobs=None число потоков берется из активного parallel_backend:
+        пакетное предсказание задает его явно, а одиночное выполняется в одном потоке.
+        """
+        steps = getattr(self.model, 'named_steps', None)
+        for step in (steps.values() if steps else [self.model]):
+            if hasattr(step, 'n_jobs'):
+                step.n_jobs = None
+    
+    def export_pickle(self, path: Optional[str] = None) -> str:
+        """
+        Сохранение модели в формате pickle (протокол 5)
+        
+        Такой файл загружается обычным pickle.load, без обертки joblib.
+        
+        Args:
+            path: Путь к файлу; по умолчанию рядом с исходной моделью
+        
+        Returns:
+            Путь к сохраненному файлу
+        """
+        if path is None:
+            path = os.path.splitext(self.model_path)[0] + PICKLE_EXTENSION
+        
+        with open(path, 'wb') as f:
+            pickle.dump(self.model, f, protocol=5)
+        
+        logger.info(f"Модель сохранена в {path}")
+        return path
+    
+    def _get_training_medians(self) -> Dict[str, float]:
+        """
+        Медианы признаков, запомненные SimpleImputer при обучении
+        
+        Returns:
+            Словарь {признак: медиана} или пустой словарь, если импьютера нет
+        """
+        steps = getattr(self.model, 'named_steps', {})
+        preprocessor = steps.get('preprocessor')
+        imputer = getattr(preprocessor, 'named_steps', {}).get('imputer', preprocessor)
+        
+        if getattr(imputer, 'strategy', None) != 'median':
+            return {}
+        
+        statistics = getattr(imputer, 'statistics_', None)
+        names = getattr(imputer, 'feature_names_in_', None)
+        if statistics is None or names is None:
+            return {}
+        
+        return {str(name).lower(): float(value) for name, value in zip(names, statistics)}
+    
+    def _get_schema(self, columns: pd.Index) -> Dict[str, Any]:
+        """
+        Разбор набора столбцов; результат кэшируется до смены набора
+        
+        Args:
+            columns: Столбцы входного DataFrame
+        
+        Returns:
+            Схема: позиции и имена нужных модели столбцов, бинарные и числовые
+            столбцы и значения для пропусков
+        """
+        key = tuple(columns)
+        cached = self._schema_cache
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        
+        positions = {str(col).lower(): i for i, col in enumerate(columns)}
+        # Только признаки модели в порядке обучения; технические и лишние столбцы не попадают
+        if self._feature_order:
+            needed = [col for col in self._feature_order if col in positions]
+        else:
+            needed = [col for col in positions if col not in DROP_COLS]
+        binary_cols_present = [col for col in BINARY_COLS if col in needed]
+        numeric_cols = [col for col in needed if col in self._fill_values and col not in BINARY_COLS]
+        
+        schema = {
+            'positions': [positions[col] for col in needed],
+            'columns': needed,
+            'binary': binary_cols_present,
+            'binary_fills': (
+                np.array([self._fill_values[col] for col in binary_cols_present], dtype=np.float32)
+                if all(col in self._fill_values for col in binary_cols_present) else None
+            ),
+            'numeric': numeric_cols,
+            'numeric_fills': pd.Series({col: self._fill_values[col] for col in numeric_cols}, dtype=np.float64),
+            # Числовые столбцы без медиан обучения: определяются по первому пакету
+            'numeric_fallback': None,
+        }
+        self._schema_cache = (key, schema)
+        return schema
+    
     def preprocess_data(self, df: pd.DataFrame) -> pd.DataFrame:
         """
         Предобработка данных
@@ -53,45 +263,68 @@ class HeartAttackModel:
         Returns:
             Обработанный DataFrame
         """
-        # Создаем копию
-        df_processed = df.copy()
+        schema = self._get_schema(df.columns)
         
-        # Приведение названий столбцов к нижнему регистру
-        df_processed.columns = df_processed.columns.str.lower()
+        # Выборка нужных столбцов (новый DataFrame без копирования лишних данных)
+        # и приведение их названий к нижнему регистру
+        df_processed = df.take(schema['positions'], axis=1)
+        df_processed.columns = schema['columns']
         
-        # Удаление ненужных столбцов
-        drop_cols = ['unnamed:_0', 'id', 'income']
-        df_processed = df_processed.drop(columns=[col for col in drop_cols if col in df_processed.columns], errors='ignore')
-        
-        # Обработка gender
+        # Обработка gender: одно правило для строковых и числовых столбцов
         if 'gender' in df_processed.columns:
-            if df_processed['gender'].dtype == 'object':
-                gender_map = {'male': 0, 'female': 1, '1.0': 0, '0.0': 1, '1': 0, '0': 1}
-                df_processed['gender'] = df_processed['gender'].astype(str).str.lower().map(gender_map).fillna(0).astype(int)
-        
-        # Бинарные признаки
-        binary_cols = ['diabetes', 'family_history', 'smoking', 'obesity',
-                      'alcohol_consumption', 'previous_heart_problems', 'medication_use']
+            df_processed['gender'] = encode_gender(df_processed['gender'].to_numpy())
         
-        for col in binary_cols:
-            if col in df_processed.columns:
-                if df_processed[col].dtype == 'float64':
-                    df_processed[col] = df_processed[col].fillna(df_processed[col].median()).round().astype(int)
+        # Бинарные признаки: одно векторное присваивание для всех столбцов
+        binary_cols = schema['binary']
+        if binary_cols:
+            binary = df_processed[binary_cols].to_numpy(np.float32)
+            fills = schema['binary_fills']
+            if fills is None:
+                fills = np.nanmedian(binary, axis=0)
+            df_processed[binary_cols] = fill_binary(binary, fills)
         
-        # Заполнение пропусков
-        numeric_cols = df_processed.select_dtypes(include=[np.number]).columns
-        for col in numeric_cols:
-            if df_processed[col].isnull().any():
-                df_processed[col] = df_processed[col].fillna(df_processed[col].median())
+        # Заполнение пропусков медианами обучающей выборки; признаки — float32
+        if self._fill_values:
+            numeric_cols = schema['numeric']
+            if numeric_cols:
+                df_processed[numeric_cols] = (
+                    df_processed[numeric_cols].fillna(schema['numeric_fills']).astype(np.float32, copy=False)
+                )
+        else:
+            if schema['numeric_fallback'] is None:
+                schema['numeric_fallback'] = list(df_processed.select_dtypes(include=[np.number]).columns)
+            numeric_cols = schema['numeric_fallback']
+            if numeric_cols:
+                numeric = df_processed[numeric_cols]
+                df_processed[numeric_cols] = numeric.fillna(numeric.median())
         
         return df_processed
     
-    def predict_batch(self, df: pd.DataFrame) -> pd.DataFrame:
+    def _model_input(self, df_processed: pd.DataFrame) -> pd.DataFrame:
+        """
+        Признаки после предобработки в float64 для модели
+        
+        CSV разбирается и предобрабатывается во float32, но пайплайн получает float64:
+        на входе float32 StandardScaler считает в float32, и часть предсказаний
+        смещается (на модели из ноутбука до 7e-3).
+        
+        Args:
+            df_processed: Результат preprocess_data
+        
+        Returns:
+            DataFrame с признаками во float64 (или исходный, если признаки модели неизвестны)
+        """
+        if not self._feature_order or tuple(df_processed.columns) != self._feature_order:
+            return df_processed
+        return self._feature_frame(df_processed.to_numpy(np.float64))
+    
+    def predict_batch(self, df: pd.DataFrame, start_index: int = 0) -> pd.DataFrame:
         """
         Пакетное предсказание
         
         Args:
             df: DataFrame с данными пациентов
+            start_index: Номер первой строки (для ID при отсутствии столбца id)
         
         Returns:
             DataFrame с ID и предсказаниями
@@ -101,13 +334,17 @@ class HeartAttackModel:
         
         # Предсказание
         if hasattr(self.model, 'predict_proba'):
-            predictions = self.model.predict_proba(df_processed)[:, 1]
+            # Сразу забираем вероятность класса 1 в непрерывный float32-массив:
+            # статистика, CSV и JSON дальше работают с 4 байтами на строку вместо 16
+            with joblib.parallel_backend('threading', n_jobs=PREDICT_N_JOBS):
+                proba = self.model.predict_proba(self._model_input(df_processed))
+            predictions = np.ascontiguousarray(proba[:, 1], dtype=np.float32)
         else:
-            predictions = self.model.predict(df_processed)
+            predictions = self.model.predict(self._model_input(df_processed))
         
         # Создание результата
         result_df = pd.DataFrame({
-            'id': df['id'].values if 'id' in df.columns else range(len(df)),
+            'id': df['id'].values if 'id' in df.columns else range(start_index, start_index + len(df)),
             'prediction': predictions
         })
         
@@ -126,13 +363,96 @@ class HeartAttackModel:
         result_df = self.predict_batch(df)
         return result_df['prediction'].iloc[0]
     
+    def _coerce(self, key: str, value: Any) -> float:
+        """
+        Приведение значения признака к числу по правилам preprocess_data
+        
+        Args:
+            key: Название признака
+            value: Значение из запроса
+        
+        Returns:
+            Числовое значение признака
+        """
+        if key == 'gender':
+            return float(encode_gender(np.array([value], dtype=object))[0])
+        
+        if value is None:
+            return self._fill_values[key]
+        
+        value = float(value)
+        if value != value:
+            return self._fill_values[key]
+        if key in BINARY_COLS:
+            return float(round(value))
+        return value
+    
+    def _feature_frame(self, arr: np.ndarray) -> pd.DataFrame:
+        """
+        Обертка массива признаков в DataFrame с именами, на которых обучалась модель
+        
+        Пайплайн, обученный на DataFrame, предупреждает о массиве без имен признаков;
+        обертка над готовым массивом не копирует данные и не требует предобработки.
+        
+        Args:
+            arr: Массив признаков в порядке обучения
+        
+        Returns:
+            DataFrame с теми же данными
+        """
+        return pd.DataFrame(arr, columns=self.model.feature_names_in_, copy=False)
+    
+    def predict_single_fast(self, data: Dict[str, Any]) -> float:
+        """
+        Предсказание для одного пациента без построчной предобработки DataFrame
+        
+        Признаки собираются сразу в массив 1×F в порядке обучения;
+        отсутствующие значения заполняются медианами обучающей выборки.
+        Если порядок признаков или медианы неизвестны, используется predict_single.
+        
+        Args:
+            data: Словарь с данными пациента
+        
+        Returns:
+            Вероятность сердечного приступа
+        """
+        if not self._feature_order or not self._fill_values:
+            return self.predict_single(pd.DataFrame([data]))
+        
+        data = {str(key).lower(): value for key, value in data.items()}
+        return self.predict_single_values([data.get(key) for key in self._feature_order])
+    
+    def predict_single_values(self, values: Sequence[Any]) -> float:
+        """
+        Предсказание для одного пациента по значениям признаков в порядке обучения
+        
+        Args:
+            values: Значения признаков в порядке feature_order (None — пропуск)
+        
+        Returns:
+            Вероятность сердечного приступа
+        """
+        # float64, как в predict_batch: пайплайн на float32 дает другие предсказания
+        arr = np.fromiter(
+            (self._coerce(key, value) for key, value in zip(self._feature_order, values)),
+            dtype=np.float64,
+            count=len(self._feature_order)
+        ).reshape(1, -1)
+        X = self._feature_frame(arr)
+        
+        if hasattr(self.model, 'predict_proba'):
+            return float(self.model.predict_proba(X)[0, 1])
+        return float(self.model.predict(X)[0])
+    
     def get_model_info(self) -> Dict[str, Any]:
         """Получение информации о модели"""
         info = {
             "model_path": self.model_path,
             "model_type": type(self.model).__name__,
             "features_count": len(self.feature_names) if self.feature_names else "unknown",
-            "model_loaded": self.model is not None
+            "model_loaded": self.model is not None,
+            # Заполнение бинарных признаков ядром numba (необязательная зависимость)
+            "numba": njit is not None
         }
         
         if self.model:
@@ -1,5 +1,7 @@
+import re
+import msgspec
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Sequence, Union
 
 class PredictionResponse(BaseModel):
     """Схема ответа для одного предсказания"""
@@ -36,4 +38,40 @@ class ModelInfoResponse(BaseModel):
     features_count: int
     model_loaded: bool
     pipeline_steps: Optional[List[str]] = None
-    classifier_type: Optional[str] = None
\ No newline at end of file
+    classifier_type: Optional[str] = None
+    numba: Optional[bool] = None
+
+def make_patient_struct(feature_names: Sequence[str], ignored: Sequence[str] = ()) -> type:
+    """
+    Схема данных одного пациента для /predict/single по признакам модели
+
+    Декодируется msgspec без промежуточной валидации pydantic. Все признаки
+    обязательны (null — пропуск, заполняется медианой обучающей выборки),
+    технические столбцы принимаются и не используются, остальные
+    неизвестные поля отклоняются.
+
+    Args:
+        feature_names: Признаки модели в порядке обучения
+        ignored: Технические столбцы датасета (например, income), допустимые в запросе
+
+    Returns:
+        Класс msgspec.Struct: сначала признаки в порядке обучения, затем
+        технические столбцы и id
+    """
+    fields = []
+    rename = {}
+    for name in feature_names:
+        # Имена признаков вроде 'ck-mb' не являются идентификаторами Python
+        attr = re.sub(r'\W|^(?=\d)', '_', name)
+        field_type = Union[str, float, None] if name == 'gender' else Optional[float]
+        fields.append((attr, field_type))
+        rename[attr] = name
+    for name in ignored:
+        if name == 'id' or name in feature_names:
+            continue
+        attr = re.sub(r'\W|^(?=\d)', '_', name)
+        fields.append((attr, Any, None))
+        rename[attr] = name
+    fields.append(('id', Union[str, int, None], None))
+
+    return msgspec.defstruct('PatientIn', fields, rename=rename, forbid_unknown_fields=True)
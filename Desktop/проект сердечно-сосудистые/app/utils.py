@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 import logging
+from typing import Dict, Any
 
 logger = logging.getLogger(__name__)
 
@@ -49,12 +50,89 @@ def calculate_statistics(predictions: np.ndarray) -> Dict[str, float]:
     Returns:
         Словарь со статистикой
     """
+    predictions = np.asarray(predictions, dtype=np.float64)
+    
+    # Среднее и std по моментам, все квантили — за одно разбиение массива
+    mean = np.add.reduce(predictions) / len(predictions)
+    variance = np.dot(predictions, predictions) / len(predictions) - mean * mean
+    q25, median, q75 = np.percentile(predictions, [25, 50, 75])
+    
     return {
-        "mean": float(np.mean(predictions)),
-        "median": float(np.median(predictions)),
-        "std": float(np.std(predictions)),
-        "min": float(np.min(predictions)),
-        "max": float(np.max(predictions)),
-        "q25": float(np.percentile(predictions, 25)),
-        "q75": float(np.percentile(predictions, 75))
-    }
\ No newline at end of file
+        "mean": float(mean),
+        "median": float(median),
+        "std": float(np.sqrt(max(variance, 0.0))),
+        "min": float(np.minimum.reduce(predictions)),
+        "max": float(np.maximum.reduce(predictions)),
+        "q25": float(q25),
+        "q75": float(q75)
+    }
+
+class PredictionStatistics:
+    """
+    Накопление статистики по предсказаниям, поступающим частями
+
+    Хранит только моменты (количество, сумма, сумма квадратов) и экстремумы,
+    поэтому память не зависит от числа обработанных строк.
+    """
+
+    def __init__(self, threshold: float = 0.5):
+        """
+        Args:
+            threshold: Порог вероятности, выше которого пациент относится к группе риска
+        """
+        self.threshold = threshold
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.risk_count = 0
+
+    def update(self, predictions: np.ndarray):
+        """
+        Добавление очередной порции предсказаний
+
+        Args:
+            predictions: Массив предсказаний
+        """
+        if len(predictions) == 0:
+            return
+
+        # Экстремумы хранятся в типе предсказаний (float32), моменты считаются во float64
+        self.min = min(self.min, np.minimum.reduce(predictions))
+        self.max = max(self.max, np.maximum.reduce(predictions))
+        predictions = np.asarray(predictions, dtype=np.float64)
+        self.count += len(predictions)
+        self.total += float(np.add.reduce(predictions))
+        self.total_sq += float(np.dot(predictions, predictions))
+        self.risk_count += int(np.count_nonzero(predictions > self.threshold))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Итоговая статистика
+
+        Returns:
+            Словарь со статистикой (std — несмещенная оценка, как в pandas)
+        """
+        if self.count == 0:
+            return {
+                "mean": 0.0, "min": 0.0, "max": 0.0, "std": 0.0,
+                "risk_count": 0, "no_risk_count": 0
+            }
+
+        mean = self.total / self.count
+        std = 0.0
+        if self.count > 1:
+            variance = (self.total_sq - self.total * mean) / (self.count - 1)
+            std = float(np.sqrt(max(variance, 0.0)))
+
+        # Экстремумы — в кратчайшей записи своего типа, как в JSON и CSV ответа:
+        # 0.1 во float32, а не 0.10000000149011612
+        return {
+            "mean": mean,
+            "min": float(str(self.min)),
+            "max": float(str(self.max)),
+            "std": std,
+            "risk_count": self.risk_count,
+            "no_risk_count": self.count - self.risk_count
+        }
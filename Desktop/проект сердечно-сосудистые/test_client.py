@@ -121,8 +121,8 @@ class HeartAttackAPIClient:
             "triglycerides": 150,
             "physical_activity_days_per_week": 3,
             "sleep_hours_per_day": 7,
-            "blood_sugar_level": 120,
-            "ck_-_mb": 25,
+            "blood_sugar": 120,
+            "ck-mb": 25,
             "troponin": 0.01,
             "gender": 1,
             "systolic_blood_pressure": 140,
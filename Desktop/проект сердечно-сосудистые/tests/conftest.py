@@ -0,0 +1,75 @@
+import os
+import sys
+import importlib
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# Признаки в том виде, в котором на них обучается модель в ноутбуке
+FEATURES = [
+    "age", "cholesterol", "heart_rate", "diabetes", "family_history", "smoking",
+    "obesity", "alcohol_consumption", "exercise_hours_per_week", "diet",
+    "previous_heart_problems", "medication_use", "stress_level",
+    "sedentary_hours_per_day", "bmi", "triglycerides",
+    "physical_activity_days_per_week", "sleep_hours_per_day", "blood_sugar",
+    "ck-mb", "troponin", "gender", "systolic_blood_pressure", "diastolic_blood_pressure",
+]
+
+BINARY_FEATURES = [
+    "diabetes", "family_history", "smoking", "obesity", "alcohol_consumption",
+    "previous_heart_problems", "medication_use", "gender",
+]
+
+
+@pytest.fixture(scope="session")
+def train_data():
+    """Небольшая синтетическая выборка с признаками модели"""
+    rng = np.random.default_rng(0)
+    n = 400
+    X = pd.DataFrame(rng.random((n, len(FEATURES))), columns=FEATURES)
+    for col in BINARY_FEATURES:
+        X[col] = rng.integers(0, 2, n).astype(float)
+    y = (X["age"] + X["cholesterol"] + rng.random(n) * 0.5 > 1.2).astype(int)
+    return X, y
+
+
+@pytest.fixture(scope="session")
+def model_path(train_data, tmp_path_factory):
+    """Путь к обученному пайплайну той же структуры, что и в ноутбуке"""
+    X, y = train_data
+    pipeline = Pipeline([
+        ("preprocessor", Pipeline([
+            ("imputer", SimpleImputer(strategy="median")),
+            ("scaler", StandardScaler()),
+        ])),
+        ("classifier", RandomForestClassifier(n_estimators=10, random_state=0)),
+    ])
+    pipeline.fit(X, y)
+    path = tmp_path_factory.mktemp("models") / "best_model.pkl"
+    joblib.dump(pipeline, path)
+    return str(path)
+
+
+@pytest.fixture(scope="session")
+def heart_model(model_path):
+    from app.model import HeartAttackModel
+    return HeartAttackModel(model_path)
+
+
+@pytest.fixture(scope="session")
+def client(model_path):
+    """Тестовый клиент API; модель загружается при импорте app.main из MODEL_PATH"""
+    from fastapi.testclient import TestClient
+
+    os.environ["MODEL_PATH"] = model_path
+    main = importlib.import_module("app.main")
+    with TestClient(main.app) as test_client:
+        yield test_client
@@ -25,5 +25,12 @@ setup(
         "pandas>=2.1.4",
         "scikit-learn>=1.3.2",
         "joblib>=1.3.2",
+        "pyarrow>=14.0.1",
+        "orjson>=3.9.10",
+        "msgspec>=0.18.4",
     ],
+    extras_require={
+        # Заполнение бинарных признаков одним проходом ядра numba
+        "numba": ["numba>=0.58.1"],
+    },
 )
\ No newline at end of file
@@ -0,0 +1,437 @@
+import io
+import os
+import shutil
+import time
+
+import joblib
+import msgspec
+import numpy as np
+import orjson
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.pipeline import Pipeline
+
+from app import model as model_module
+from app.model import GENDER_MAP, HeartAttackModel, encode_gender, fill_binary
+from app.utils import PredictionStatistics
+from conftest import FEATURES
+
+
+def make_patient(train_data, row: int = 0) -> dict:
+    X, _ = train_data
+    return {key: float(value) for key, value in X.iloc[row].items()}
+
+
+def encode_like_notebook(df: pd.DataFrame) -> pd.DataFrame:
+    """Кодирование gender так же, как при обучении модели в ноутбуке"""
+    return df.assign(gender=df["gender"].astype(str).str.lower().map(GENDER_MAP).fillna(0))
+
+
+# Статистика по предсказаниям
+
+@pytest.mark.parametrize("chunks", [[np.array([0.3])], [np.linspace(0, 1, 7), np.array([0.9, 0.1]), np.array([])]])
+def test_prediction_statistics_matches_pandas(chunks):
+    statistics = PredictionStatistics()
+    for chunk in chunks:
+        statistics.update(chunk)
+    result = statistics.to_dict()
+
+    values = pd.Series(np.concatenate(chunks))
+    assert result["mean"] == pytest.approx(values.mean())
+    assert result["min"] == pytest.approx(values.min())
+    assert result["max"] == pytest.approx(values.max())
+    # std — несмещенная оценка (ddof=1), для одного значения pandas дает NaN, а мы 0
+    expected_std = values.std() if len(values) > 1 else 0.0
+    assert result["std"] == pytest.approx(expected_std)
+    assert result["risk_count"] == int((values > 0.5).sum())
+    assert result["risk_count"] + result["no_risk_count"] == len(values)
+
+
+def test_prediction_statistics_float32_shortest():
+    chunks = [np.array([0.1, 0.3], dtype=np.float32), np.array([5.943e-06, 0.2], dtype=np.float32)]
+    statistics = PredictionStatistics()
+    for chunk in chunks:
+        statistics.update(chunk)
+    result = statistics.to_dict()
+
+    # Экстремумы — кратчайшая запись float32, моменты — по значениям во float64
+    assert result["max"] == 0.3
+    assert result["min"] == 5.943e-06
+    assert result["mean"] == np.concatenate(chunks).astype(np.float64).mean()
+
+
+def test_prediction_statistics_empty():
+    statistics = PredictionStatistics()
+    statistics.update(np.array([]))
+    assert statistics.to_dict() == {
+        "mean": 0.0, "min": 0.0, "max": 0.0, "std": 0.0,
+        "risk_count": 0, "no_risk_count": 0
+    }
+
+
+# Предобработка
+
+def test_encode_gender_matches_map():
+    values = np.array(["Male", "female", "1.0", "0.0", "1", "0", "FEMALE", "other", "", None, 1.0, "verylongvalue"],
+                      dtype=object)
+    expected = pd.Series(values).astype(str).str.lower().map(GENDER_MAP).fillna(0).astype(int)
+    np.testing.assert_array_equal(encode_gender(values), expected.to_numpy())
+
+
+@pytest.fixture(params=["numpy", "numba"])
+def binary_backend(request, monkeypatch):
+    if request.param == "numba":
+        pytest.importorskip("numba")
+        if model_module.njit is None:
+            pytest.skip("numba не используется модулем")
+    else:
+        monkeypatch.setattr(model_module, "njit", None)
+    return request.param
+
+
+def test_fill_binary(binary_backend):
+    x = np.array([[0.0, np.nan, 1.0],
+                  [1.0, 1.0, np.nan],
+                  [np.nan, 0.0, 0.4],
+                  [0.6, 1.0, 1.0]], dtype=np.float32)
+    fills = np.nanmedian(x, axis=0)
+
+    expected = pd.DataFrame(x).apply(lambda col: col.fillna(col.median()).round().astype(int))
+    result = fill_binary(x, fills)
+
+    assert result.dtype == np.int8
+    np.testing.assert_array_equal(result, expected.to_numpy())
+
+
+# Предсказания модели
+
+def test_fast_path_matches_batch(heart_model, train_data):
+    X, _ = train_data
+    batch = heart_model.predict_batch(X.head(20))
+    for row in range(20):
+        fast = heart_model.predict_single_fast(make_patient(train_data, row))
+        assert fast == pytest.approx(batch["prediction"].iloc[row], abs=1e-6)
+
+
+def test_fast_path_fills_missing_with_training_medians(heart_model, train_data):
+    X, _ = train_data
+    patient = make_patient(train_data)
+    patient["age"] = None
+    expected = heart_model.model.predict_proba(encode_like_notebook(X.head(1)).assign(age=X["age"].median()))[0, 1]
+    assert heart_model.predict_single_fast(patient) == pytest.approx(expected, abs=1e-6)
+
+
+def test_model_receives_float64(model_path, train_data, monkeypatch):
+    X, _ = train_data
+    # Отдельный экземпляр: подмена метода не должна остаться в общей модели сессии
+    heart_model = model_module.HeartAttackModel(model_path)
+    dtypes = []
+    predict_proba = heart_model.model.predict_proba
+
+    def recording_predict_proba(features):
+        dtypes.append(set(features.dtypes))
+        return predict_proba(features)
+
+    monkeypatch.setattr(heart_model.model, "predict_proba", recording_predict_proba)
+    # Значения в том виде, в котором они читаются из CSV (float32)
+    heart_model.predict_batch(X.head(5).astype(np.float32))
+    heart_model.predict_single_fast(make_patient(train_data))
+
+    assert dtypes == [{np.dtype(np.float64)}, {np.dtype(np.float64)}]
+
+
+def test_batch_runs_in_threading_backend(model_path, train_data, monkeypatch):
+    from joblib.parallel import ThreadingBackend, get_active_backend
+    X, _ = train_data
+    heart_model = HeartAttackModel(model_path)
+    backends = []
+    predict_proba = heart_model.model.predict_proba
+
+    def recording_predict_proba(features):
+        backends.append(get_active_backend())
+        return predict_proba(features)
+
+    monkeypatch.setattr(heart_model.model, "predict_proba", recording_predict_proba)
+    heart_model.predict_batch(X.head(5))
+
+    backend, n_jobs = backends[0]
+    assert isinstance(backend, ThreadingBackend)
+    assert n_jobs == model_module.PREDICT_N_JOBS
+
+
+def test_saved_n_jobs_is_reset(train_data, tmp_path):
+    X, y = train_data
+    pipeline = Pipeline([("classifier", RandomForestClassifier(n_estimators=4, n_jobs=2, random_state=0))])
+    path = str(tmp_path / "model.pkl")
+    joblib.dump(pipeline.fit(X, y), path)
+
+    heart_model = HeartAttackModel(path)
+    assert heart_model.model.named_steps["classifier"].n_jobs is None
+    np.testing.assert_allclose(
+        heart_model.model.predict_proba(X)[:, 1], pipeline.predict_proba(X)[:, 1]
+    )
+
+
+def test_load_with_mmap_mode(model_path, heart_model, train_data):
+    X, _ = train_data
+    mapped = HeartAttackModel(model_path, mmap_mode="r")
+
+    assert mapped.mmap_mode == "r"
+    np.testing.assert_array_equal(
+        mapped.predict_batch(X.head(20))["prediction"], heart_model.predict_batch(X.head(20))["prediction"]
+    )
+
+
+def test_export_pickle_roundtrip(heart_model, train_data, tmp_path):
+    X, _ = train_data
+    path = heart_model.export_pickle(str(tmp_path / "best_model.pickle"))
+    loaded = HeartAttackModel(path)
+
+    assert loaded.feature_order == heart_model.feature_order
+    np.testing.assert_array_equal(
+        loaded.predict_batch(X.head(20))["prediction"], heart_model.predict_batch(X.head(20))["prediction"]
+    )
+
+
+def test_export_pickle_default_path(model_path, tmp_path):
+    model = HeartAttackModel(shutil.copy(model_path, str(tmp_path / "model.pkl")))
+    assert model.export_pickle() == str(tmp_path / "model.pickle")
+    assert os.path.exists(tmp_path / "model.pickle")
+
+
+# API
+
+def test_predict_single(client, train_data, heart_model):
+    patient = {key.upper(): value for key, value in make_patient(train_data).items()}
+    patient["ID"] = "p1"
+    response = client.post("/predict/single", json=patient)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["patient_id"] == "p1"
+    assert body["prediction"] == pytest.approx(heart_model.predict_single_fast(make_patient(train_data)), abs=1e-6)
+
+
+@pytest.mark.parametrize("payload", [{}, [], {"age": 50}])
+def test_predict_single_rejects_incomplete(client, payload):
+    assert client.post("/predict/single", json=payload).status_code == 422
+
+
+def test_predict_single_ignores_dataset_columns(client, train_data, heart_model):
+    patient = make_patient(train_data)
+    response = client.post("/predict/single", json=dict(patient, income=0.5, **{"Unnamed:_0": 3, "id": 12}))
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["patient_id"] == "12"
+    assert body["prediction"] == pytest.approx(heart_model.predict_single_fast(patient), abs=1e-6)
+
+
+def test_predict_single_rejects_unknown_field(client, train_data):
+    patient = make_patient(train_data)
+    patient["unknown"] = 1
+    assert client.post("/predict/single", json=patient).status_code == 422
+
+
+def test_model_info_reports_numba(client):
+    response = client.get("/model/info")
+    assert response.status_code == 200
+    assert response.json()["numba"] == (model_module.njit is not None)
+
+
+def test_decode_patient_case_insensitive(client, train_data):
+    from app import main
+    patient = dict(make_patient(train_data), id=7)
+    lower = main.decode_patient(orjson.dumps(patient))
+    upper = main.decode_patient(orjson.dumps({key.upper(): value for key, value in patient.items()}))
+
+    assert isinstance(lower, main.PatientIn)
+    assert upper == lower
+    assert lower.id == 7
+
+
+@pytest.mark.parametrize("payload", [
+    {"AGE": "old"},
+    [1, 2],
+])
+def test_decode_patient_rejects_invalid(client, train_data, payload):
+    from app import main
+    if isinstance(payload, dict):
+        payload = dict({key.upper(): value for key, value in make_patient(train_data).items()}, **payload)
+    with pytest.raises(msgspec.ValidationError):
+        main.decode_patient(orjson.dumps(payload))
+
+
+def test_predict_single_values_matches_dict(heart_model, train_data):
+    patient = make_patient(train_data)
+    values = [patient[key] for key in heart_model.feature_order]
+    assert heart_model.predict_single_values(values) == heart_model.predict_single_fast(patient)
+
+
+def csv_upload(df: pd.DataFrame) -> dict:
+    return {"file": ("data.csv", df.to_csv(index=False), "text/csv")}
+
+
+def test_predict_csv_stream(client, train_data, heart_model):
+    X, _ = train_data
+    df = X.head(30).copy()
+    df.insert(0, "id", range(100, 130))
+    df["gender"] = np.where(df["gender"] == 1.0, "Male", "Female")
+    response = client.post("/predict/csv/stream", files=csv_upload(df))
+
+    assert response.status_code == 200
+    result = pd.read_csv(io.StringIO(response.text))
+    assert list(result.columns) == ["id", "prediction"]
+    assert result["id"].tolist() == list(range(100, 130))
+    expected = heart_model.predict_batch(df)["prediction"].to_numpy()
+    np.testing.assert_allclose(result["prediction"].to_numpy(), expected, atol=1e-6)
+
+
+def test_numeric_gender_same_on_all_paths(client, train_data, heart_model):
+    X, _ = train_data
+    df = X.head(10)
+    expected = heart_model.model.predict_proba(encode_like_notebook(df))[:, 1]
+
+    response = client.post("/predict/csv/stream", files=csv_upload(df))
+    assert response.status_code == 200
+    streamed = pd.read_csv(io.StringIO(response.text))["prediction"].to_numpy()
+    np.testing.assert_allclose(streamed, expected, atol=1e-6)
+    np.testing.assert_allclose(heart_model.predict_batch(df)["prediction"], expected, atol=1e-6)
+
+    for row in range(len(df)):
+        patient = make_patient(train_data, row)
+        for gender in (patient["gender"], int(patient["gender"]), str(patient["gender"]), str(int(patient["gender"]))):
+            body = client.post("/predict/single", json=dict(patient, gender=gender)).json()
+            assert body["prediction"] == pytest.approx(expected[row], abs=1e-6)
+
+
+def test_predict_csv_stream_missing_column(client, train_data):
+    X, _ = train_data
+    response = client.post("/predict/csv/stream", files=csv_upload(X.head(5).drop(columns=["age"])))
+    assert response.status_code == 500
+    assert "age" in response.json()["detail"]
+
+
+def test_predict_csv_stream_invalid_values(client, train_data):
+    X, _ = train_data
+    df = X.head(5).astype(object)
+    df.loc[2, "cholesterol"] = "abc"
+    assert client.post("/predict/csv/stream", files=csv_upload(df)).status_code == 500
+
+
+@pytest.mark.parametrize("ids, expected_ids", [
+    (range(1, 6), [1, 2, 3, 4, 5]),
+    ([1, 2, 3, 4, "x5"], ["1", "2", "3", "4", "x5"]),
+    (["1.0", "2.5", "3", "4", "5"], ["1.0", "2.5", "3", "4", "5"]),
+    (None, [0, 1, 2, 3, 4]),
+    (["a1", "a2", "a3", "a4", "a5"], ["a1", "a2", "a3", "a4", "a5"]),
+])
+def test_predict_csv_ids(client, train_data, ids, expected_ids):
+    X, _ = train_data
+    df = X.head(5).copy()
+    if ids is not None:
+        df.insert(0, "id", list(ids))
+    response = client.post("/predict/csv", files=csv_upload(df))
+
+    assert response.status_code == 200
+    assert [row["id"] for row in response.json()["predictions"]] == expected_ids
+
+
+def test_predict_csv_json_float32_shortest(client, train_data, heart_model):
+    X, _ = train_data
+    df = X.head(20)
+    response = client.post("/predict/csv", files=csv_upload(df))
+
+    assert response.status_code == 200
+    body = response.json()
+    # Каждое значение — кратчайшая запись float32, как в CSV для скачивания
+    expected = [float(str(value)) for value in heart_model.predict_batch(df)["prediction"].to_numpy()]
+    assert [row["prediction"] for row in body["predictions"]] == expected
+    assert body["statistics"]["min"] == min(expected)
+    assert body["statistics"]["max"] == max(expected)
+
+    download = client.get(body["download_url"])
+    assert pd.read_csv(io.StringIO(download.text))["prediction"].tolist() == expected
+
+
+def test_download_predictions(client, train_data):
+    X, _ = train_data
+    body = client.post("/predict/csv", files=csv_upload(X.head(5))).json()
+    response = client.get(body["download_url"])
+
+    assert response.status_code == 200
+    result = pd.read_csv(io.StringIO(response.text))
+    assert list(result.columns) == ["id", "prediction"]
+    assert len(result) == 5
+
+
+@pytest.mark.parametrize("filename", [
+    "heart_predictions_missing.csv",
+    "other.csv",
+    "heart_predictions_x.txt",
+    "..%2Fheart_predictions_x.csv",
+])
+def test_download_rejects_unknown_files(client, filename):
+    assert client.get(f"/download/{filename}").status_code == 404
+
+
+def test_cleanup_predictions(tmp_path, monkeypatch):
+    from app import main
+    monkeypatch.setattr(main, "PREDICTIONS_DIR", str(tmp_path))
+    old = tmp_path / "heart_predictions_old.csv"
+    fresh = tmp_path / "heart_predictions_fresh.csv"
+    other = tmp_path / "other.csv"
+    for path in (old, fresh, other):
+        path.write_text("id,prediction\n")
+    expired = time.time() - 2 * main.PREDICTIONS_TTL
+    os.utime(old, (expired, expired))
+    os.utime(other, (expired, expired))
+
+    assert main.cleanup_predictions() == 1
+    assert not old.exists()
+    assert fresh.exists() and other.exists()
+
+
+@pytest.fixture
+def small_blocks(client, monkeypatch):
+    """Маленький блок Arrow, чтобы даже короткий файл читался несколькими блоками"""
+    from app import main
+    monkeypatch.setattr(main, "CSV_BLOCK_SIZE", 4096)
+
+
+def test_predict_csv_stream_multiple_blocks(client, train_data, heart_model, small_blocks):
+    X, _ = train_data
+    df = X.copy()
+    df.insert(0, "id", range(len(df)))
+    # Лишние столбцы пусты в первом блоке, а значения (число и текст) появляются позже,
+    # как и 'Male' в gender
+    df["income"] = np.nan
+    df.loc[len(df) - 3:, "income"] = 0.5
+    df["comment"] = np.nan
+    df.loc[len(df) - 2:, "comment"] = "late text"
+    df["gender"] = df["gender"].astype(object)
+    df.loc[len(df) - 1, "gender"] = "Male"
+    response = client.post("/predict/csv/stream", files=csv_upload(df))
+
+    assert response.status_code == 200
+    result = pd.read_csv(io.StringIO(response.text))
+    assert result["id"].tolist() == list(range(len(df)))
+    expected = heart_model.model.predict_proba(encode_like_notebook(df[FEATURES]))[:, 1]
+    np.testing.assert_allclose(result["prediction"].to_numpy(), expected, atol=1e-6)
+
+
+def test_predict_csv_text_id_after_integer_ids(client, train_data, small_blocks):
+    X, _ = train_data
+    df = X.copy()
+    df.insert(0, "id", [str(i) for i in range(len(df) - 1)] + ["late-text"])
+    response = client.post("/predict/csv", files=csv_upload(df))
+
+    assert response.status_code == 200
+    assert [row["id"] for row in response.json()["predictions"]] == df["id"].tolist()
+
+
+def test_predict_csv_stream_empty(client):
+    response = client.post("/predict/csv/stream", files=csv_upload(pd.DataFrame(columns=FEATURES)))
+    assert response.status_code == 200
+    assert response.text == "id,prediction\n"